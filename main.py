@@ -2,18 +2,19 @@ from fastapi import FastAPI, UploadFile, Form
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 import os
-import shutil
-import pandas as pd
+import asyncio
+import functools
+import numpy as np
 import joblib
 import shap
 from dotenv import load_dotenv
 import google.generativeai as genai
 
 from risk_utils import (
-    extract_address_and_building_from_pdf,
+    ocr_pdf_once,
+    parse_address_and_building,
     get_lawd_cd,
     get_latest_officetel_trade,
-    extract_text_from_pdf_with_ocr,
     parse_ocr_text_to_features,
     interpret_risk_score
 )
@@ -26,6 +27,13 @@ SERVICE_KEY = os.getenv("PUBLIC_DATA_API_KEY")
 genai.configure(api_key=GEMINI_API_KEY)
 model = genai.GenerativeModel("gemini-2.0-flash")
 
+# ✅ 위험도 모델 및 SHAP 설명기 (요청마다 로드하지 않도록 시작 시 1회 로드)
+MODEL = joblib.load("./risk_score_model_by_ratio.pkl")
+EXPLAINER = shap.TreeExplainer(MODEL)
+
+# ✅ 모델 입력 특징 순서 (학습 시 컬럼 순서와 동일)
+FEATURE_ORDER = ("전세가율", "신탁", "근저당정규화", "가압류", "압류", "소유권이전", "임차권등기명령")
+
 # ✅ FastAPI 앱
 app = FastAPI()
 
@@ -38,18 +46,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# ✅ 분석 설명 생성 (Gemini 사용)
-def generate_llm_explanation(score, level, shap_list):
-    top_factors = sorted(shap_list, key=lambda x: abs(x["impact"]), reverse=True)[:3]
+# ✅ Gemini 호출 (요약 키가 같으면 캐시된 응답 재사용, _llm.cache_info()로 확인 가능)
+@functools.lru_cache(maxsize=512)
+def _llm(summary_key):
+    score, level, top_factors = summary_key
     factor_text = "\n".join([
-        f"- {f['feature']}: 영향도 {abs(f['impact']):.2f}, 위험 {('상승' if f['direction'] == 'up' else '완화')}"
-        for f in top_factors
+        f"- {feature}: 영향도 {abs(impact):.2f}, 위험 {('상승' if direction == 'up' else '완화')}"
+        for feature, impact, direction in top_factors
     ])
 
     prompt = f"""
 전세사기 분석 결과입니다:
 
-• 위험 점수: {round(score, 2)}점
+• 위험 점수: {score}점
 • 등급: {level}
 • 주요 영향 요인:
 {factor_text}
@@ -60,6 +69,16 @@ def generate_llm_explanation(score, level, shap_list):
     response = model.generate_content(prompt)
     return response.text.strip()
 
+# ✅ 분석 설명 생성 (Gemini 사용)
+def generate_llm_explanation(score, level, shap_list):
+    top_factors = sorted(shap_list, key=lambda x: abs(x["impact"]), reverse=True)[:3]
+    summary_key = (
+        round(float(score), 1),
+        level,
+        tuple((f["feature"], round(f["impact"], 2), f["direction"]) for f in top_factors)
+    )
+    return _llm(summary_key)
+
 # ✅ 분석 API
 @app.post("/analyze")
 async def analyze_pdf(
@@ -67,12 +86,12 @@ async def analyze_pdf(
     area: float = Form(...),
     jeonse_price: int = Form(...)
 ):
-    temp_path = f"./temp/{file.filename}"
-    os.makedirs("./temp", exist_ok=True)
-    with open(temp_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # 업로드된 PDF를 디스크에 쓰지 않고 메모리에서 바로 연다
+    pdf_bytes = await file.read()
 
-    address, building_name = extract_address_and_building_from_pdf(temp_path)
+    # OCR과 실거래가 조회는 블로킹 작업이므로 스레드에서 실행해 이벤트 루프를 막지 않음
+    ocr_text = await asyncio.to_thread(ocr_pdf_once, pdf_bytes)
+    address, building_name = parse_address_and_building(ocr_text)
     if not address or not building_name:
         return JSONResponse(status_code=400, content={"error": "주소 또는 건물명 추출 실패"})
 
@@ -80,31 +99,25 @@ async def analyze_pdf(
     if not lawd_cd:
         return JSONResponse(status_code=400, content={"error": "법정동코드 조회 실패"})
 
-    latest_info = get_latest_officetel_trade(lawd_cd, building_name, area, SERVICE_KEY)
+    latest_info = await asyncio.to_thread(get_latest_officetel_trade, lawd_cd, building_name, area, SERVICE_KEY)
     if latest_info is None:
         return JSONResponse(status_code=404, content={"error": "실거래가 조회 실패"})
 
     sale_price = int(latest_info["거래금액(만원)"].replace(",", "")) * 10000
     jeonse_ratio = jeonse_price / sale_price
 
-    ocr_text = extract_text_from_pdf_with_ocr(temp_path)
     features = parse_ocr_text_to_features(ocr_text, jeonse_ratio)
-    df = pd.DataFrame([features])
+    X = np.array([[features[k] for k in FEATURE_ORDER]], dtype=np.float32)
 
-    model_file = joblib.load("./risk_score_model_by_ratio.pkl")
-    score = model_file.predict(df)[0]
+    score = MODEL.predict(X)[0]
     level, message = interpret_risk_score(score)
 
-    explainer = shap.Explainer(model_file)
-    shap_values = explainer(df)
-    shap_result = sorted(
-        zip(df.columns, shap_values[0].values),
-        key=lambda x: abs(x[1]),
-        reverse=True
-    )
+    # Explanation 객체 없이 ndarray로 바로 받고, 영향도 절댓값 내림차순 정렬
+    shap_values = EXPLAINER.shap_values(X, check_additivity=False)[0]
+    order = np.argsort(-np.abs(shap_values), kind="stable")
     shap_result = [
-        {"feature": k, "impact": float(v), "direction": "up" if v > 0 else "down"}
-        for k, v in shap_result
+        {"feature": FEATURE_ORDER[i], "impact": float(shap_values[i]), "direction": "up" if shap_values[i] > 0 else "down"}
+        for i in order
     ]
 
     # ✅ Gemini 기반 요약
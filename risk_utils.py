@@ -1,38 +1,146 @@
+import os
+
+# ✅ 워커마다 Tesseract 내부 OpenMP 스레드는 1개만 사용 (tesserocr import 전에 설정)
+os.environ.setdefault("OMP_THREAD_LIMIT", "1")
+
 import fitz
-from PIL import Image, ImageOps
-import pytesseract
-import io
+import numpy as np
+import cv2
 import re
+import threading
+import functools
+import subprocess
+import tempfile
+from datetime import date
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import requests
-from bs4 import BeautifulSoup
+import lxml.etree as ET
+import ahocorasick
+
+try:
+    import tesserocr
+except ImportError:  # tesserocr 미설치 환경에서는 tesseract CLI 일괄 처리로 대체
+    tesserocr = None
+
+# ✅ PDF 렌더링 해상도 (Tesseract 권장값 300 DPI, 환경변수 OCR_DPI로 조정)
+OCR_DPI = int(os.getenv("OCR_DPI", "300"))
+
+# ✅ Tesseract 실행 파일 경로 (tesserocr 미설치 시 CLI 일괄 처리에 사용)
+TESSERACT_CMD = os.getenv("TESSERACT_CMD", "tesseract")
+
+# ✅ 실거래가 API 요청 제한 시간(초, 환경변수 TRADE_API_TIMEOUT으로 조정)
+TRADE_API_TIMEOUT = float(os.getenv("TRADE_API_TIMEOUT", "10"))
+
+# ✅ 정규식 (모듈 로드 시 1회 컴파일)
+_RE_HANGUL = re.compile(r'[가-힣]')
+_RE_COLLECTIVE = re.compile(r"\[\s*집\s*합\s*건\s*물\s*\]\s*([^\n]+)")
+_RE_BLDG_FILTER = re.compile(r"(제|\d+호|층|동|\d+)")
+_RE_MORTGAGE = re.compile(r'근저당권설정금(\d+,\d+|\d+)')
+
+# ✅ 등기부 위험 키워드 (Aho-Corasick 오토마톤으로 한 번에 탐색)
+RISK_KEYWORDS = ("신탁", "가압류", "압류", "소유권이전", "임차권등기명령")
+_KEYWORD_AUTOMATON = ahocorasick.Automaton()
+for _keyword in RISK_KEYWORDS:
+    _KEYWORD_AUTOMATON.add_word(_keyword, _keyword)
+_KEYWORD_AUTOMATON.make_automaton()
+
+# ✅ OCR 스레드 풀 (스레드마다 Tesseract 언어 모델을 한 번만 로드해 재사용)
+# OMP_THREAD_LIMIT=1 이므로 워커 1개가 코어 1개를 쓴다 (환경변수 OCR_MAX_WORKERS로 조정)
+OCR_MAX_WORKERS = max(1, int(os.getenv("OCR_MAX_WORKERS", str(os.cpu_count() or 1))))
+_ocr_executor = ThreadPoolExecutor(max_workers=OCR_MAX_WORKERS, thread_name_prefix="ocr")
+_tess_local = threading.local()
 
-# ✅ Tesseract 경로 설정 (Mac 기준)
-pytesseract.pytesseract.tesseract_cmd = "/opt/homebrew/bin/tesseract"
+def _get_tess_api():
+    api = getattr(_tess_local, "api", None)
+    if api is None:
+        api = tesserocr.PyTessBaseAPI(
+            lang="kor+eng",
+            psm=tesserocr.PSM.SINGLE_BLOCK,
+            oem=tesserocr.OEM.LSTM_ONLY
+        )
+        _tess_local.api = api
+    return api
 
-# ✅ 이미지 전처리
-def preprocess_image(img):
-    gray = img.convert("L")
-    enhanced = ImageOps.autocontrast(gray)
-    binarized = enhanced.point(lambda x: 0 if x < 180 else 255, '1')
-    return binarized
+# ✅ 이미지 전처리 (grayscale uint8 배열 → Otsu 이진화 + 글자 획 굵게)
+_STROKE_KERNEL = np.ones((2, 2), np.uint8)
+
+def preprocess_image(gray):
+    _, binarized = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # 흰 배경에 검은 글자이므로 erode(최솟값 필터)가 검은 획을 굵게 만든다
+    return cv2.erode(binarized, _STROKE_KERNEL, iterations=1)
 
 # ✅ 한글만 추출
 def clean_korean_text(text):
-    return ''.join(re.findall(r'[가-힣]', text))
+    return ''.join(_RE_HANGUL.findall(text))
+
+# ✅ 페이지 이미지 1장 OCR (워커 스레드에서 실행)
+def _ocr_page(gray):
+    binarized = preprocess_image(gray)
+    height, width = binarized.shape
+    api = _get_tess_api()
+    api.SetImageBytes(binarized.tobytes(), width, height, 1, width)
+    # raw 바이트에는 DPI 정보가 없으므로 렌더링 해상도를 직접 알려준다
+    api.SetSourceResolution(OCR_DPI)
+    return api.GetUTF8Text()
+
+# ✅ 여러 페이지를 tesseract 프로세스 1회 실행으로 OCR (이미지 목록 파일 사용)
+def _ocr_pages_batch(grays):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image_paths = []
+        for idx, gray in enumerate(grays):
+            binarized = preprocess_image(gray)
+            height, width = binarized.shape
+            image_path = os.path.join(tmp_dir, f"page_{idx:04d}.pgm")
+            with open(image_path, "wb") as f:
+                f.write(f"P5\n{width} {height}\n255\n".encode())
+                f.write(binarized.tobytes())
+            image_paths.append(image_path)
+
+        list_path = os.path.join(tmp_dir, "images.txt")
+        with open(list_path, "w") as f:
+            f.write("\n".join(image_paths) + "\n")
 
-# ✅ PDF에서 주소 및 건물명 추출
-def extract_address_and_building_from_pdf(pdf_path):
-    doc = fitz.open(pdf_path)
-    text = ""
+        completed = subprocess.run(
+            [TESSERACT_CMD, list_path, "stdout", "-l", "kor+eng", "--psm", "6", "--oem", "1", "--dpi", str(OCR_DPI)],
+            capture_output=True,
+            check=True
+        )
+
+    # 페이지 구분자(\f)로 나눔
+    return completed.stdout.decode("utf-8").split("\x0c")[:len(grays)]
+
+# ✅ PDF 전체 OCR 텍스트 추출 (페이지 병렬, 1회만 수행)
+def ocr_pdf_once(pdf_bytes):
+    # PyMuPDF는 스레드 안전하지 않으므로 렌더링은 현재 스레드에서, OCR만 풀에 넘긴다
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    grays = []
+    futures = []
     for page in doc:
-        pix = page.get_pixmap(dpi=400)
-        img = Image.open(io.BytesIO(pix.tobytes()))
-        img = preprocess_image(img)
-        page_text = pytesseract.image_to_string(img, lang="kor+eng", config="--psm 6 --oem 1")
-        text += page_text + "\n"
+        # PNG 인코딩/디코딩 없이 grayscale raw 픽셀을 그대로 사용
+        pix = page.get_pixmap(dpi=OCR_DPI, colorspace=fitz.csGRAY, alpha=False)
+        gray = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width)
+        if tesserocr is None:
+            grays.append(gray)
+        else:
+            futures.append(_ocr_executor.submit(_ocr_page, gray))
+    doc.close()
+
+    if tesserocr is None and grays:
+        # 연속된 페이지 묶음마다 tesseract 프로세스 1개씩 풀에서 병렬 실행 (페이지 순서 유지)
+        chunk_size = -(-len(grays) // min(OCR_MAX_WORKERS, len(grays)))
+        futures = [
+            _ocr_executor.submit(_ocr_pages_batch, grays[i:i + chunk_size])
+            for i in range(0, len(grays), chunk_size)
+        ]
+        texts = [text for future in futures for text in future.result()]
+    else:
+        texts = [future.result() for future in futures]
+    return "".join(text + "\n" for text in texts)
 
-    match = re.search(r"\[\s*집\s*합\s*건\s*물\s*\]\s*([^\n]+)", text)
+# ✅ OCR 텍스트에서 주소 및 건물명 추출
+def parse_address_and_building(text):
+    match = _RE_COLLECTIVE.search(text)
     if not match:
         print("❌ '[집합건물]' 줄 없음")
         return None, None
@@ -42,11 +150,12 @@ def extract_address_and_building_from_pdf(pdf_path):
 
     dong_end_idx = -1
     for i, word in enumerate(words):
-        if '동' in word:
-            dong_end_idx = i
-        if re.match(r"\d{1,4}-?\d*", word):
+        # 지번은 항상 숫자로 시작하므로 첫 글자만 확인
+        if word[:1].isdecimal():
             dong_end_idx = i - 1
             break
+        if '동' in word:
+            dong_end_idx = i
 
     if dong_end_idx < 3:
         return None, None
@@ -57,11 +166,20 @@ def extract_address_and_building_from_pdf(pdf_path):
     address = f"{region} {citygu} {dong}"
 
     building_words = words[dong_end_idx + 2:]
-    cleaned = [w for w in building_words if not re.search(r"(제|\d+호|층|동|\d+)", w)]
+    cleaned = [w for w in building_words if not _RE_BLDG_FILTER.search(w)]
     building_name = clean_korean_text(''.join(cleaned))
 
     return address.strip(), building_name
 
+# ✅ 법정동코드 CSV → (시도, 시군구, 읍면동) 인덱스 (경로별 1회만 로드)
+@functools.lru_cache(maxsize=1)
+def _lawd_index(csv_path):
+    df = pd.read_csv(csv_path, dtype=str)
+    keys = ["시도명", "시군구명", "읍면동명"]
+    # 기존 필터링과 같이 동일 키의 첫 번째 행을 사용
+    df = df.drop_duplicates(subset=keys, keep="first")
+    return df.set_index(keys)["법정동코드"].str[:5].to_dict()
+
 # ✅ 주소 → 법정동코드
 def get_lawd_cd(address, csv_path):
     parts = address.split()
@@ -70,98 +188,115 @@ def get_lawd_cd(address, csv_path):
         return None
 
     시도, 시군구, 읍면동 = parts[0], parts[1], parts[2]
-    df = pd.read_csv(csv_path, dtype=str)
-
-    match = df[
-        (df["시도명"] == 시도) &
-        (df["시군구명"] == 시군구) &
-        (df["읍면동명"] == 읍면동)
-    ]
+    lawd_cd = _lawd_index(csv_path).get((시도, 시군구, 읍면동))
 
-    if not match.empty:
-        return match.iloc[0]["법정동코드"][:5]
+    if lawd_cd is not None:
+        return lawd_cd
     else:
         print("❌ 법정동코드를 찾을 수 없습니다.")
         return None
 
-# ✅ PDF 전체 OCR 텍스트 추출
-def extract_text_from_pdf_with_ocr(pdf_path):
-    doc = fitz.open(pdf_path)
-    full_text = ""
-    for page in doc:
-        pix = page.get_pixmap(dpi=400)
-        img = Image.open(io.BytesIO(pix.tobytes()))
-        img = preprocess_image(img)
-        text = pytesseract.image_to_string(img, lang="kor+eng", config="--psm 6 --oem 1")
-        full_text += text + "\n"
-    return full_text
+# ✅ 월별 실거래가 API 호출 (스레드 풀에서 병렬 실행)
+def _fetch_officetel_month(url, params):
+    print(f"📦 {params['DEAL_YMD']} 조회 중...")
+    try:
+        return requests.get(url, params=params, timeout=TRADE_API_TIMEOUT)
+    except requests.RequestException:
+        # 응답이 없거나 지연된 달은 건너뛰고 나머지 달로 조회
+        print(f"❌ {params['DEAL_YMD']} 조회 실패")
+        return None
 
 # ✅ 실거래가 조회
 def get_latest_officetel_trade(lawd_cd, building_name, area, service_key):
     url = "http://apis.data.go.kr/1613000/RTMSDataSvcOffiTrade/getRTMSDataSvcOffiTrade"
-    result = []
 
-    for month in range(1, 13):
-        deal_ymd = f"2024{month:02d}"
-        print(f"📦 {deal_ymd} 조회 중...")
-        params = {
+    params_list = [
+        {
             "serviceKey": service_key,
             "LAWD_CD": lawd_cd,
-            "DEAL_YMD": deal_ymd,
+            "DEAL_YMD": f"2024{month:02d}",
             "pageNo": "1",
             "numOfRows": "100"
         }
+        for month in range(1, 13)
+    ]
+    with ThreadPoolExecutor(max_workers=len(params_list)) as executor:
+        responses = list(executor.map(lambda params: _fetch_officetel_month(url, params), params_list))
 
-        response = requests.get(url, params=params)
-        soup = BeautifulSoup(response.text, "xml")
-        items = soup.find_all("item")
+    # 건물명이 일치하는 거래만 남기면서 (면적차이 오름차순, 계약일 내림차순) 1위만 유지
+    latest = None
+    latest_key = None
+    for response in responses:
+        if response is None:
+            continue
+        try:
+            root = ET.fromstring(response.content)
+        except ET.XMLSyntaxError:
+            # 빈 응답이나 XML이 아닌 응답은 해당 월만 건너뜀
+            print("❌ 실거래가 응답을 해석할 수 없습니다.")
+            continue
 
-        for item in items:
+        for item in root.iterfind(".//item"):
+            offi_nm = item.findtext("offiNm")
+            if not offi_nm or building_name not in offi_nm:
+                continue
+            # 거래금액이 없는 항목은 제외 (API가 앞뒤 공백을 붙여 주므로 제거)
+            deal_amount = (item.findtext("dealAmount") or "").strip()
+            if not deal_amount:
+                continue
             try:
-                result.append({
-                    "단지명": item.find("offiNm").text,
-                    "전용면적": float(item.find("excluUseAr").text),
-                    "계약일": f"{item.find('dealYear').text}-{item.find('dealMonth').text}-{item.find('dealDay').text}",
-                    "거래금액(만원)": item.find("dealAmount").text
-                })
-            except:
+                excl_area = float(item.findtext("excluUseAr"))
+                # 건물명이 일치한 거래만 날짜 변환 (존재하지 않는 날짜는 기존처럼 제외)
+                contract_date = date(
+                    int(item.findtext("dealYear")),
+                    int(item.findtext("dealMonth")),
+                    int(item.findtext("dealDay"))
+                )
+            except (TypeError, ValueError):
                 continue
 
-    df = pd.DataFrame(result)
-    df_filtered = df[df["단지명"].str.contains(building_name, na=False)].copy()
-    df_filtered["면적차이"] = abs(df_filtered["전용면적"] - area)
-    df_filtered["계약일"] = pd.to_datetime(df_filtered["계약일"], errors="coerce")
-    df_filtered = df_filtered.dropna(subset=["계약일"])
-    if df_filtered.empty:
+            area_diff = abs(excl_area - area)
+            key = (area_diff, -contract_date.toordinal())
+            if latest_key is None or key < latest_key:
+                latest_key = key
+                latest = {
+                    "단지명": offi_nm,
+                    "전용면적": excl_area,
+                    "계약일": contract_date.isoformat(),
+                    "거래금액(만원)": deal_amount,
+                    "면적차이": area_diff
+                }
+
+    if latest is None:
         print("❌ 조건에 맞는 거래 정보가 없습니다.")
         return None
-    latest = df_filtered.sort_values(["면적차이", "계약일"], ascending=[True, False]).head(1).squeeze()
 
     return latest
 
 # ✅ OCR 텍스트 → 특징 추출
 def parse_ocr_text_to_features(text, jeonse_ratio):
     text = text.replace(" ", "")
-    
-    def contains(keyword):
-        return int(keyword in text)
+
+    # 겹치는 키워드(가압류 ⊃ 압류)도 모두 보고되므로 기존 `in` 검사와 결과가 같다
+    found = {keyword: 0 for keyword in RISK_KEYWORDS}
+    for _, keyword in _KEYWORD_AUTOMATON.iter(text):
+        found[keyword] = 1
 
     def normalize_mortgage(text):
-        matches = re.findall(r'근저당권설정금(\d+,\d+|\d+)', text)
-        values = [int(m.replace(',', '')) for m in matches]
-        if not values:
-            return 0
-        max_value = max(values)
+        max_value = max(
+            (int(m.group(1).replace(',', ''), 10) for m in _RE_MORTGAGE.finditer(text)),
+            default=0
+        )
         return max_value / 1_0000_0000
 
     return {
         "전세가율": jeonse_ratio,
-        "신탁": contains("신탁"),
+        "신탁": found["신탁"],
         "근저당정규화": normalize_mortgage(text),
-        "가압류": contains("가압류"),
-        "압류": contains("압류"),
-        "소유권이전": contains("소유권이전"),
-        "임차권등기명령": contains("임차권등기명령")
+        "가압류": found["가압류"],
+        "압류": found["압류"],
+        "소유권이전": found["소유권이전"],
+        "임차권등기명령": found["임차권등기명령"]
     }
 
 # ✅ 위험 점수 해석